@@ -1,64 +1,497 @@
 
 import streamlit as st
-import json
+import atexit
+import bisect
+import codecs
+import hashlib
+import io
+import msgpack
+import numpy as np
+import orjson
 import os
+import threading
+from types import MappingProxyType
+
+# The log is folded into the snapshot once it outgrows it (but never below this size).
+MIN_COMPACT_BYTES = 64 * 1024
+
+# Optional fields and the values a record gets when they are missing.
+BOOK_DEFAULTS = {"year": "", "genre": "", "read": False}
+
+# Snapshot layout: a (magic, version, fields) header, then an array of one
+# tuple per book in field order, so the keys are stored once per file.
+BOOK_FIELDS = ("title", "author", "year", "genre", "read")
+SNAPSHOT_HEADER = ("plib", 1, BOOK_FIELDS)
+# How every snapshot starts on disk: a 3-element array whose first item is "plib".
+SNAPSHOT_PREFIX = b"\x93\xa4plib"
+
+def _is_valid_book(book):
+    # Titles and authors are lowercased for the indexes, so both must be strings.
+    return isinstance(book, dict) and isinstance(book.get("title"), str) and isinstance(book.get("author"), str)
+
+def _normalize_book(book):
+    return {**BOOK_DEFAULTS, **book}
+
+def _encode_record(record):
+    # Checked before any state changes: the book must fit both the log (JSON)
+    # and the snapshot (msgpack), or it could never be compacted again.
+    try:
+        if "book" in record:
+            book = _normalize_book(record["book"])
+            msgpack.packb(tuple(book[field] for field in BOOK_FIELDS))
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    except (TypeError, ValueError, OverflowError) as error:
+        raise ValueError(f"Book cannot be saved: {error}") from error
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
 
 class BookCollection:
     def __init__(self):
-        self.book_list = []
-        self.storage_file = "book_data.json"
-        self.read_from_file()
+        # Books are stored column-wise: row i of every column is one book.
+        self._titles = []
+        self._authors = []
+        self._years = []
+        self._genres = []
+        self._read_flags = []
+        self.storage_file = "book_data.msgpack"
+        # Libraries saved before the msgpack snapshot are read from here once.
+        self.legacy_storage_file = "book_data.json"
+        self.log_file = "book_data.log"
+        self._dirty = False
+        self._log = None
+        self._snapshot_hash = None
+        self._snapshot_bytes = 0
+        self._log_matches_snapshot = False
+        self._log_valid_bytes = 0
+        self._title_index = {}
+        self._titles_lc = []
+        self._authors_lc = []
+        self._trigram_index = {}
+        # Bumped on every change, so derived views can tell when they are stale.
+        self._version = 0
+        # Cached views are immutable, because every session shares them.
+        self._book_list_cache = ()
+        self._book_list_version = 0
+        self._titles_cache = ()
+        self._titles_version = 0
+        # NumPy copy of _read_flags for the progress reductions, rebuilt once per version.
+        self._read_array = np.zeros(0, dtype=np.bool_)
+        self._read_array_version = 0
+        # The library is read on first use, not at construction time.
+        self._loaded = False
+        # st.cache_resource shares one collection across sessions and script threads;
+        # reentrant because the public methods call each other (e.g. flush from a mutation).
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if not self._loaded:
+                self.read_from_file()
 
     def read_from_file(self):
+        with self._lock:
+            self._loaded = False
+            self._dirty = False
+            self._version += 1
+            data = b""
+            for path in (self.storage_file, self.legacy_storage_file):
+                try:
+                    with open(path, "rb") as file:
+                        data = file.read()
+                    break
+                except FileNotFoundError:
+                    continue
+            self._snapshot_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+            self._snapshot_bytes = len(data)
+            if data.startswith(SNAPSHOT_PREFIX):
+                books = self._decode_snapshot(data)
+            else:
+                books = self._decode_json(data)
+                # Rewrite a JSON library in the msgpack format at the next compaction.
+                self._dirty = bool(books)
+            del data
+            self._titles = [book["title"] for book in books]
+            self._authors = [book["author"] for book in books]
+            self._years = [book["year"] for book in books]
+            self._genres = [book["genre"] for book in books]
+            self._read_flags = [bool(book["read"]) for book in books]
+            del books
+            self._rebuild_index()
+            self._replay_log()
+            # Only a load that ran to completion counts; a failed one is retried on next use.
+            self._loaded = True
+
+    def _decode_json(self, data):
+        try:
+            loaded_books = orjson.loads(data.removeprefix(codecs.BOM_UTF8))
+        except orjson.JSONDecodeError:
+            return []
+        if not isinstance(loaded_books, list):
+            return []
+        return [_normalize_book(book) for book in loaded_books if _is_valid_book(book)]
+
+    def _decode_snapshot(self, data):
+        unpacker = msgpack.Unpacker(io.BytesIO(data), raw=False)
+        books = []
+        try:
+            magic, version, fields = unpacker.unpack()
+            if magic != SNAPSHOT_HEADER[0] or version != SNAPSHOT_HEADER[1]:
+                return []
+            for _ in range(unpacker.read_array_header()):
+                row = unpacker.unpack()
+                if isinstance(row, list) and len(row) == len(fields):
+                    book = dict(zip(fields, row))
+                    if _is_valid_book(book):
+                        books.append(_normalize_book(book))
+        except (msgpack.OutOfData, ValueError, TypeError):
+            return []
+        return books
+
+    def _replay_log(self):
+        # The log's header names the snapshot it was written against; a log left
+        # behind by a compaction that crashed before removing it is stale.
+        self._log_matches_snapshot = False
+        self._log_valid_bytes = 0
+        try:
+            with open(self.log_file, "rb") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return
+        try:
+            header = orjson.loads(lines[0]) if lines else None
+        except orjson.JSONDecodeError:
+            header = None
+        if not isinstance(header, dict) or header.get("base") != self._snapshot_hash:
+            return
+        self._log_matches_snapshot = True
+        self._log_valid_bytes = len(lines[0])
+        for line in lines[1:]:
+            # Stop at a torn tail; it is truncated before the next append.
+            if not line.endswith(b"\n"):
+                break
+            try:
+                self._apply(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                break
+            self._log_valid_bytes += len(line)
+            self._mark_dirty()
+
+    def _apply(self, record):
+        # Records that do not describe a valid mutation are skipped, never half-applied.
+        if not isinstance(record, dict):
+            return
+        op = record.get("op")
+        if op == "add" and _is_valid_book(record.get("book")):
+            self._add(record["book"])
+        elif op == "del" and isinstance(record.get("title"), str):
+            self._delete(record["title"])
+        elif op == "upd" and isinstance(record.get("title"), str) and _is_valid_book(record.get("book")):
+            self._update(record["title"], record["book"])
+
+    def _write_log(self, line):
+        # Write-ahead: called before the columns change, so a failed write leaves
+        # memory and disk agreeing that the mutation never happened.
         try:
-            with open(self.storage_file, "r") as file:
-                loaded_books = json.load(file)
-                self.book_list = [
-                    book for book in loaded_books
-                    if isinstance(book, dict) and "title" in book and "author" in book
-                ]
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.book_list = []
+            if self._log is None:
+                if self._log_matches_snapshot:
+                    os.truncate(self.log_file, self._log_valid_bytes)
+                    self._log = open(self.log_file, "ab")
+                else:
+                    header = orjson.dumps({"base": self._snapshot_hash}, option=orjson.OPT_APPEND_NEWLINE)
+                    self._log = open(self.log_file, "wb")
+                    self._log.write(header)
+                    self._log_matches_snapshot = True
+                    self._log_valid_bytes = len(header)
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        except OSError:
+            # Reopen on the next append, which truncates any partial line first.
+            self._close_log()
+            raise
+        self._log_valid_bytes += len(line)
+
+    def _close_log(self):
+        if self._log is not None:
+            try:
+                self._log.close()
+            except OSError:
+                pass
+            self._log = None
+
+    def _logged(self):
+        self._mark_dirty()
+        if self._log_valid_bytes > max(self._snapshot_bytes, MIN_COMPACT_BYTES):
+            self.flush()
+
+    def _rebuild_index(self):
+        self._titles_lc = [title.lower() for title in self._titles]
+        self._authors_lc = [author.lower() for author in self._authors]
+        # This loop runs once per book on every load, so the per-row method call
+        # and attribute lookups of _index_trigrams are inlined into locals.
+        title_index = self._title_index = {}
+        trigram_index = self._trigram_index = {}
+        for i, (title_lc, author_lc) in enumerate(zip(self._titles_lc, self._authors_lc)):
+            title_index.setdefault(title_lc, []).append(i)
+            for gram in _trigrams(title_lc) | _trigrams(author_lc):
+                trigram_index.setdefault(gram, set()).add(i)
+
+    def _index_trigrams(self, i):
+        for gram in _trigrams(self._titles_lc[i]) | _trigrams(self._authors_lc[i]):
+            self._trigram_index.setdefault(gram, set()).add(i)
+
+    def _unindex_trigrams(self, i):
+        for gram in _trigrams(self._titles_lc[i]) | _trigrams(self._authors_lc[i]):
+            postings = self._trigram_index[gram]
+            postings.discard(i)
+            if not postings:
+                del self._trigram_index[gram]
+
+    @property
+    def book_list(self):
+        with self._lock:
+            self._ensure_loaded()
+            if self._book_list_version != self._version:
+                self._book_list_cache = tuple(MappingProxyType(self._row(i)) for i in range(len(self._titles)))
+                self._book_list_version = self._version
+            return self._book_list_cache
+
+    @property
+    def titles(self):
+        with self._lock:
+            self._ensure_loaded()
+            if self._titles_version != self._version:
+                self._titles_cache = tuple(self._titles)
+                self._titles_version = self._version
+            return self._titles_cache
+
+    def _row(self, i):
+        return {
+            "title": self._titles[i],
+            "author": self._authors[i],
+            "year": self._years[i],
+            "genre": self._genres[i],
+            "read": self._read_flags[i],
+        }
 
     def save_to_file(self):
-        with open(self.storage_file, "w") as file:
-            json.dump(self.book_list, file, indent=4)
+        with self._lock:
+            if not self._dirty:
+                return
+            packer = msgpack.Packer()
+            buffer = io.BytesIO()
+            buffer.write(packer.pack(SNAPSHOT_HEADER))
+            buffer.write(packer.pack_array_header(len(self._titles)))
+            for row in zip(self._titles, self._authors, self._years, self._genres, self._read_flags):
+                buffer.write(packer.pack(row))
+            data = buffer.getvalue()
+            data_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+            # Edits that cancel out leave the snapshot byte-for-byte identical.
+            if data_hash == self._snapshot_hash:
+                self._dirty = False
+                return
+            temp_file = self.storage_file + ".tmp"
+            # A buffered file passes one large write straight through, and unlike a raw
+            # FileIO write it keeps writing until every byte is out.
+            with open(temp_file, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, self.storage_file)
+            self._snapshot_hash = data_hash
+            self._snapshot_bytes = len(data)
+            self._dirty = False
+
+    def _mark_dirty(self):
+        self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            # Compact: fold the log into a fresh snapshot, then drop the log.
+            if not self._loaded or not self._dirty:
+                return
+            self.save_to_file()
+            self._close_log()
+            try:
+                os.remove(self.log_file)
+            except FileNotFoundError:
+                pass
+            self._log_matches_snapshot = False
+            self._log_valid_bytes = 0
+
+    def close(self):
+        # For an instance that is being replaced: drop the exit hook (which would
+        # otherwise keep it alive) and the log handle. Its log stays on disk for the next load.
+        with self._lock:
+            atexit.unregister(self.flush)
+            self._close_log()
 
     def add_book(self, book):
-        self.book_list.append(book)
-        self.save_to_file()
+        if not _is_valid_book(book):
+            raise ValueError("A book needs a title and an author.")
+        line = _encode_record({"op": "add", "book": book})
+        with self._lock:
+            self._ensure_loaded()
+            self._write_log(line)
+            self._add(book)
+            self._logged()
 
     def delete_book(self, title):
-        self.book_list = [b for b in self.book_list if b["title"].lower() != title.lower()]
-        self.save_to_file()
+        line = _encode_record({"op": "del", "title": title})
+        with self._lock:
+            self._ensure_loaded()
+            if title.lower() not in self._title_index:
+                return
+            self._write_log(line)
+            self._delete(title)
+            self._logged()
 
     def update_book(self, original_title, updated_book):
-        for i, book in enumerate(self.book_list):
-            if book["title"].lower() == original_title.lower():
-                self.book_list[i] = updated_book
-                break
-        self.save_to_file()
+        if not _is_valid_book(updated_book):
+            raise ValueError("A book needs a title and an author.")
+        line = _encode_record({"op": "upd", "title": original_title, "book": updated_book})
+        with self._lock:
+            self._ensure_loaded()
+            if self._update_row(original_title, updated_book) is None:
+                return
+            self._write_log(line)
+            self._update(original_title, updated_book)
+            self._logged()
+
+    def _add(self, book):
+        # Read every field before writing any column, so a bad record leaves them all untouched.
+        book = _normalize_book(book)
+        title, author, year, genre, read = (book[field] for field in BOOK_FIELDS)
+        title_lc, author_lc = title.lower(), author.lower()
+        self._version += 1
+        self._titles.append(title)
+        self._authors.append(author)
+        self._years.append(year)
+        self._genres.append(genre)
+        self._read_flags.append(bool(read))
+        self._titles_lc.append(title_lc)
+        self._authors_lc.append(author_lc)
+        self._title_index.setdefault(self._titles_lc[-1], []).append(len(self._titles) - 1)
+        self._index_trigrams(len(self._titles) - 1)
+
+    def _delete(self, title):
+        rows = self._title_index.pop(title.lower(), None)
+        if not rows:
+            return False
+        self._version += 1
+        # Swap-and-pop from the highest row down, so the row moved into each
+        # hole always belongs to another title.
+        for i in reversed(rows):
+            self._unindex_trigrams(i)
+            last = len(self._titles) - 1
+            if i != last:
+                self._unindex_trigrams(last)
+                for column in (self._titles, self._authors, self._years, self._genres, self._read_flags):
+                    column[i] = column[last]
+                self._titles_lc[i] = self._titles_lc[last]
+                self._authors_lc[i] = self._authors_lc[last]
+                self._index_trigrams(i)
+                moved_rows = self._title_index[self._titles_lc[i]]
+                moved_rows.remove(last)
+                bisect.insort(moved_rows, i)
+            for column in (self._titles, self._authors, self._years, self._genres, self._read_flags):
+                column.pop()
+            self._titles_lc.pop()
+            self._authors_lc.pop()
+        return True
+
+    def _update_row(self, original_title, updated_book):
+        # The row update_book would change, or None when it is missing or the edit is a no-op.
+        rows = self._title_index.get(original_title.lower())
+        if not rows:
+            return None
+        updated_book = _normalize_book(updated_book)
+        current = self._row(rows[0])
+        if all(updated_book[field] == value for field, value in current.items()):
+            return None
+        return rows[0]
+
+    def _update(self, original_title, updated_book):
+        i = self._update_row(original_title, updated_book)
+        if i is None:
+            return False
+        old_key = original_title.lower()
+        rows = self._title_index[old_key]
+        updated_book = _normalize_book(updated_book)
+        title, author, year, genre, read = (updated_book[field] for field in BOOK_FIELDS)
+        new_key, author_lc = title.lower(), author.lower()
+        self._version += 1
+        self._unindex_trigrams(i)
+        self._titles[i] = title
+        self._authors[i] = author
+        self._years[i] = year
+        self._genres[i] = genre
+        self._read_flags[i] = bool(read)
+        self._titles_lc[i] = new_key
+        self._authors_lc[i] = author_lc
+        self._index_trigrams(i)
+        if new_key != old_key:
+            rows.pop(0)
+            if not rows:
+                del self._title_index[old_key]
+            bisect.insort(self._title_index.setdefault(new_key, []), i)
+        return True
+
+    def get_book(self, title):
+        with self._lock:
+            self._ensure_loaded()
+            rows = self._title_index.get(title.lower())
+            return self._row(rows[0]) if rows else None
 
     def search_books(self, search_text):
-        return [
-            book for book in self.book_list
-            if search_text.lower() in book["title"].lower() or search_text.lower() in book["author"].lower()
-        ]
+        with self._lock:
+            self._ensure_loaded()
+            query = search_text.lower()
+            titles_lc, authors_lc = self._titles_lc, self._authors_lc
+            if len(query) < 3:
+                candidates = range(len(titles_lc))
+            else:
+                postings = sorted((self._trigram_index.get(gram, set()) for gram in _trigrams(query)), key=len)
+                candidates = sorted(set.intersection(*postings))
+            return [
+                self._row(i) for i in candidates
+                if query in titles_lc[i] or query in authors_lc[i]
+            ]
 
     def get_progress(self):
-        total = len(self.book_list)
-        read = sum(1 for book in self.book_list if book.get("read", False))
-        return total, read, (read / total * 100 if total else 0)
+        with self._lock:
+            self._ensure_loaded()
+            if self._read_array_version != self._version:
+                self._read_array = np.array(self._read_flags, dtype=np.bool_)
+                self._read_array_version = self._version
+            total = self._read_array.size
+            read = int(np.count_nonzero(self._read_array))
+            return total, read, (float(self._read_array.mean()) * 100 if total else 0)
 
 # ---------- STREAMLIT INTERFACE ----------
 
 st.set_page_config(page_title="📚 Personal Library", layout="centered")
 st.title("📚 Personal Library Manager")
 
-book_manager = BookCollection()
+@st.cache_resource
+def get_manager():
+    return BookCollection()
+
+book_manager = get_manager()
 
 menu = st.sidebar.selectbox("Menu", ["Add Book", "View Books", "Update Book", "Delete Book", "Search", "Reading Progress"])
 
+# Unsaved edits are already in the change log, which the reload replays.
+if st.sidebar.button(
+    "Reload from disk",
+    help="Re-read the library file (book_data.msgpack, or book_data.json until the first save) and the change log.",
+):
+    book_manager.close()
+    get_manager.clear()
+    book_manager = get_manager()
+
 if menu == "Add Book":
     st.subheader("Add a New Book")
     title = st.text_input("Title")
@@ -77,18 +510,19 @@ if menu == "Add Book":
 
 elif menu == "View Books":
     st.subheader("Your Book Collection")
-    if not book_manager.book_list:
+    books = book_manager.book_list
+    if not books:
         st.info("No books found.")
     else:
-        for idx, book in enumerate(book_manager.book_list, 1):
+        for idx, book in enumerate(books, 1):
             st.write(f"**{idx}. {book['title']}** by {book['author']} ({book['year']}) - {book['genre']} - {'Read' if book['read'] else 'Unread'}")
 
 elif menu == "Update Book":
     st.subheader("Update a Book")
-    titles = [book["title"] for book in book_manager.book_list]
+    titles = book_manager.titles
     if titles:
         selected_title = st.selectbox("Select book to update", titles)
-        book_to_edit = next(b for b in book_manager.book_list if b["title"] == selected_title)
+        book_to_edit = book_manager.get_book(selected_title)
 
         title = st.text_input("Title", value=book_to_edit["title"])
         author = st.text_input("Author", value=book_to_edit["author"])
@@ -105,7 +539,7 @@ elif menu == "Update Book":
 
 elif menu == "Delete Book":
     st.subheader("Delete a Book")
-    titles = [book["title"] for book in book_manager.book_list]
+    titles = book_manager.titles
     if titles:
         selected_title = st.selectbox("Select book to delete", titles)
         if st.button("Delete"):
@@ -132,4 +566,3 @@ elif menu == "Reading Progress":
     st.write(f"Books Read: **{read}**")
     st.progress(progress / 100)
     st.write(f"**Progress: {progress:.2f}%**")
-